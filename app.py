@@ -5,10 +5,16 @@ Streamlit UI with GPT-4o Integration
 """
 
 import streamlit as st
-from openai import OpenAI
-import json
+from openai import AsyncOpenAI, OpenAI
+import asyncio
+import orjson
 import re
 import os
+import threading
+import time
+from functools import partial
+from string import Template
+from dataclasses import dataclass, astuple
 from dotenv import load_dotenv
 from calculations import (
     RetirementInputs,
@@ -17,7 +23,8 @@ from calculations import (
     calculate_whatif_scenario,
     format_result_summary,
     format_currency,
-    generate_excel_plan
+    generate_excel_plan,
+    HAS_OPENPYXL
 )
 
 # Load environment variables from .env file
@@ -31,471 +38,90 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Color palette from template
-# Accent: #D1A36C (golden/tan)
-# Gray: #8B8D98
-# Background: #111111 (dark)
-# Light backgrounds for cards: #1a1a1a, #222222
-# Text on dark: #E8E8E8, #FFFFFF
-
-# Custom CSS for dark theme UI
-st.markdown("""
-<style>
-    /* Main app background */
-    .stApp {
-        background-color: #111111;
-    }
-
-    /* Sidebar styling */
-    [data-testid="stSidebar"] {
-        background-color: #1a1a1a;
-    }
-    [data-testid="stSidebar"] .stMarkdown {
-        color: #E8E8E8;
-    }
-
-    /* Logo container */
-    .logo-container {
-        display: flex;
-        justify-content: center;
-        margin-bottom: 1rem;
-    }
-    .logo-container img {
-        max-height: 80px;
-        width: auto;
-    }
-
-    /* Headers */
-    .main-header {
-        font-size: 2.5rem;
-        font-weight: bold;
-        color: #D1A36C;
-        text-align: center;
-        margin-bottom: 0.5rem;
-    }
-    .sub-header {
-        font-size: 1.1rem;
-        color: #8B8D98;
-        text-align: center;
-        margin-bottom: 2rem;
-    }
-    .section-header {
-        font-size: 1.3rem;
-        font-weight: bold;
-        color: #D1A36C;
-        margin-top: 1.5rem;
-        margin-bottom: 0.5rem;
-        border-bottom: 2px solid #D1A36C;
-        padding-bottom: 0.3rem;
-    }
-
-    /* Metric cards - golden accent */
-    .metric-card {
-        background: linear-gradient(135deg, #2a2520 0%, #1a1815 100%);
-        border: 1px solid #D1A36C;
-        padding: 1.5rem;
-        border-radius: 12px;
-        color: #FFFFFF;
-        text-align: center;
-        margin: 0.5rem 0;
-    }
-    .metric-value {
-        font-size: 1.8rem;
-        font-weight: bold;
-        color: #D1A36C;
-    }
-    .metric-label {
-        font-size: 0.9rem;
-        color: #E8E8E8;
-        opacity: 0.9;
-    }
-
-    /* Green highlight card for main result */
-    .metric-card-highlight {
-        background: linear-gradient(135deg, #1a2a1a 0%, #152015 100%);
-        border: 1px solid #4a7c4a;
-        padding: 1.5rem;
-        border-radius: 12px;
-        color: #FFFFFF;
-        text-align: center;
-        margin: 0.5rem 0;
-    }
-    .metric-card-highlight .metric-value {
-        color: #6abf6a;
-    }
-
-    /* Info box - dark with gold border */
-    .info-box {
-        background: #1a1a1a;
-        padding: 1rem;
-        border-radius: 10px;
-        border-left: 4px solid #D1A36C;
-        margin: 0.5rem 0;
-        color: #E8E8E8;
-    }
-    .info-box strong {
-        color: #D1A36C;
-    }
-
-    /* Assumption box - dark with gray accent */
-    .assumption-box {
-        background: #1a1a1a;
-        padding: 1rem;
-        border-radius: 10px;
-        border-left: 4px solid #8B8D98;
-        margin: 0.5rem 0;
-        color: #E8E8E8;
-    }
-
-    /* Disclaimer box - dark with amber warning */
-    .disclaimer-box {
-        background: #2a2515;
-        padding: 1rem;
-        border-radius: 10px;
-        border-left: 4px solid #D1A36C;
-        margin: 1rem 0;
-        font-size: 0.9rem;
-        color: #E8E8E8;
-    }
-    .disclaimer-box strong {
-        color: #D1A36C;
-    }
-
-    /* Next steps box - dark with muted green */
-    .next-steps-box {
-        background: #1a2a1a;
-        padding: 1rem;
-        border-radius: 10px;
-        border-left: 4px solid #6abf6a;
-        margin: 1rem 0;
-        color: #E8E8E8;
-    }
-    .next-steps-box strong {
-        color: #6abf6a;
-    }
-
-    /* Warning box - dark with red accent */
-    .warning-box {
-        background: #2a1a1a;
-        padding: 1rem;
-        border-radius: 10px;
-        border-left: 4px solid #bf6a6a;
-        margin: 1rem 0;
-        color: #E8E8E8;
-    }
-    .warning-box strong {
-        color: #bf6a6a;
-    }
-
-    /* What-if cards */
-    .whatif-card {
-        background: #1a1a1a;
-        padding: 1rem;
-        border-radius: 10px;
-        border: 1px solid #8B8D98;
-        margin: 0.5rem 0;
-        color: #E8E8E8;
-    }
-    .whatif-card strong {
-        color: #D1A36C;
-    }
-    .whatif-card-base {
-        background: #1a2a1a;
-        padding: 1rem;
-        border-radius: 10px;
-        border: 1px solid #6abf6a;
-        margin: 0.5rem 0;
-        color: #E8E8E8;
-    }
-    .whatif-card-base strong {
-        color: #6abf6a;
-    }
-
-    /* Chat messages */
-    [data-testid="stChatMessage"] {
-        background-color: #1a1a1a;
-        border: 1px solid #333333;
-    }
-
-    /* Chat input container */
-    [data-testid="stChatInput"] {
-        background-color: #1a1a1a !important;
-    }
-
-    /* Chat input text area */
-    [data-testid="stChatInput"] textarea {
-        background-color: #222222 !important;
-        color: #E8E8E8 !important;
-        border: 1px solid #8B8D98 !important;
-        border-radius: 8px !important;
-    }
-    [data-testid="stChatInput"] textarea:focus {
-        border-color: #D1A36C !important;
-        box-shadow: 0 0 0 1px #D1A36C !important;
-    }
-    [data-testid="stChatInput"] textarea::placeholder {
-        color: #8B8D98 !important;
-    }
-
-    /* Chat input submit button */
-    [data-testid="stChatInput"] button {
-        background-color: #D1A36C !important;
-        color: #111111 !important;
-    }
-    [data-testid="stChatInput"] button:hover {
-        background-color: #b8905d !important;
-    }
-
-    /* Bottom chat input container styling */
-    .stChatInput {
-        background-color: #111111 !important;
-    }
-    [data-testid="stBottom"] {
-        background-color: #111111 !important;
-    }
-    [data-testid="stBottomBlockContainer"] {
-        background-color: #111111 !important;
-    }
-
-    /* Input fields */
-    .stTextInput input, .stNumberInput input {
-        background-color: #222222;
-        color: #E8E8E8;
-        border: 1px solid #8B8D98;
-    }
-    .stTextInput input:focus, .stNumberInput input:focus {
-        border-color: #D1A36C;
-    }
-
-    /* Buttons */
-    .stButton button {
-        background-color: #D1A36C;
-        color: #111111;
-        border: none;
-        font-weight: bold;
-    }
-    .stButton button:hover {
-        background-color: #b8905d;
-        color: #111111;
-    }
-
-    /* Download button */
-    .stDownloadButton button {
-        background-color: #D1A36C;
-        color: #111111;
-        border: none;
-        font-weight: bold;
-    }
-
-    /* Info/Warning/Success messages */
-    .stAlert {
-        background-color: #1a1a1a;
-        color: #E8E8E8;
-    }
-
-    /* Markdown text */
-    .stMarkdown {
-        color: #E8E8E8;
-    }
-
-    /* Metrics */
-    [data-testid="stMetricValue"] {
-        color: #D1A36C;
-    }
-    [data-testid="stMetricLabel"] {
-        color: #8B8D98;
-    }
-
-    /* Horizontal rule */
-    hr {
-        border-color: #333333;
-    }
-
-    /* Caption text */
-    .stCaption {
-        color: #8B8D98;
-    }
-</style>
-""", unsafe_allow_html=True)
+# Custom CSS for dark theme UI (see styles.css for the color palette)
+CSS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "styles.css")
 
-# System prompt based on the updated specification
-SYSTEM_PROMPT = """
-# SYSTEM PROMPT
-Today is 03 feb 2026
-
-**Goal Planning Assistant (Retirement Only)**
-**Excel-Wired | Conversation-Driven | Deterministic**
-
----
-
-## 1. ROLE & OBJECTIVE
-
-You are a **goal-based financial planning assistant**.
 
-Your purpose is to:
+@st.cache_data(show_spinner=False)
+def _load_css() -> str:
+    """Read the stylesheet once; reruns reuse the cached text"""
+    with open(CSS_PATH, encoding="utf-8") as f:
+        return f.read()
 
-1. Conduct a **structured, multi-turn conversation** to collect *all materially relevant inputs*
-2. Ensure **no hidden assumptions** are made
-3. Use the **attached Excel model as the single source of calculation truth**
-4. Produce:
-   * future cost / corpus required
-   * monthly savings (SIP-style) required
-5. Clearly explain:
-   * *why* this number exists
-   * *which assumptions* were used
-6. Include **explicit guardrails and disclaimers**
 
-You are **not**:
-* a product recommender
-* a tax advisor
-* a portfolio constructor
+st.markdown(f"<style>{_load_css()}</style>", unsafe_allow_html=True)
 
----
-
-## 2. NON-NEGOTIABLE GLOBAL RULES
-
-1. Handle **one goal per session**
-2. **Conversation first, calculation last**
-3. Ask **one question per turn**
-4. Make **no silent assumptions**
-5. Allow "I don't know" → apply safe default + disclose
-6. Follow **Excel model as authoritative**
-7. Use **FV-based SIP only** (constant monthly, no step-ups)
-8. Keep outputs **planning-level**, not precise forecasts
-9. **Normalize all monetary inputs to annual values** before calculation
-10. If **current living expenses exceed current income**, explicitly flag this in the explanation and state that the plan assumes future normalization of income and/or expenses, **without recomputing numbers**
-11. Round final monthly savings outputs to a **clean, human-readable figure** (e.g., nearest ₹500 or ₹1,000)
+# Output token caps per call type (output tokens dominate response latency)
+MAX_TOKENS_COLLECT = 300
+MAX_TOKENS_FOLLOWUP = 600
+MAX_TOKENS_WHATIF = 500
+MAX_TOKENS_SUMMARY = 200
 
----
-
-## 3. SUPPORTED GOAL
+# Follow-up history sent verbatim; older turns are folded into a running summary
+FOLLOWUP_HISTORY_WINDOW = 16  # 8 user/assistant turns
+FOLLOWUP_TOKEN_BUDGET = 2000  # Upper bound on tokens of verbatim history per call
 
-* Retirement Planning
+# Marker the collection prompt emits before the final JSON payload
+CALC_SENTINEL = "CALCULATION_READY"
 
----
+# Plan-keyed caches expire after a day so entries from old sessions don't pile up
+PLAN_CACHE_TTL = 24 * 60 * 60
 
-## 4. TOP-LEVEL CONVERSATION FLOW
+# Identical conversations replay the previous reply instead of re-calling the API
+CHAT_CACHE_TTL = 60 * 60
+CHAT_CACHE_MAX_ENTRIES = 512
 
-Start → Retirement Planning Flow
-
----
-
-# 🧠 5. RETIREMENT PLANNING — FULL CONVERSATION LOGIC
-
-### R1. Current Age
-* Ask for current age or DOB
-* If DOB is provided, compute age
-
-### R2. Retirement Age
-* Ask desired retirement age
-* Suggest a **retirement age range of 55–65** (based on current trends or if the user would like to work longer)
-* Validate: retirement age > current age
-
-### R3. Time to Save (Derived)
-retirement age − current age
-
-### R4. Life Expectancy / Retirement Duration
-* Ask till what age retirement savings should last
-* If unknown, default to **85** and disclose
-years to provide = life expectancy − retirement age
-
-### R5. Dependents During Retirement
-Ask who will be financially supported:
-* Self / spouse only
-* Children
-* Parents
-* Combination
-* Not sure
-
-### R6. Current Living Expenses (Mandatory)
-* Ask current living expenses
-* **Explicitly confirm whether the value is monthly or annual**
-* Normalize internally to **annual**
-* Do not ask for line items
-
-### R7. Inflation for Living Expenses (Locked)
-living expense inflation = 0.06
-
-### R8. Living Expenses at Retirement (Authoritative Derived Output)
-current annual living expenses × (1 + 0.06) ^ (time to retirement)
-
-### R9. Retirement Corpus Required (Authoritative Output)
-* Treat "corpus required" from Excel logic as final target
-* Use living expenses at retirement + years to provide
-* If retirement cashflows are discounted, **use the same return rate as the selected risk profile**
-* Explicitly disclose that **the same return assumption is applied pre- and post-retirement**, unless the Excel model specifies otherwise
-
-### R10. Existing Investment Portfolio (Mandatory)
-* Ask for the **total current investment portfolio value**
-* Treat this as **existing retirement savings**
-* Zero allowed
-
-### R11. Corpus Gap (Derived)
-corpus required − existing investment portfolio
-
-### R12. Risk Profile (Mandatory Selector)
-* Conservative → 0.08
-* Balanced / Moderate → 0.12
-* Aggressive → 0.15
-
-### R13. Monthly Savings Required (Authoritative Output)
-* Use FV-based SIP
-* Inputs: corpus gap, time to save (months), selected return
-* Output must align with Excel "Monthly Savings required"
-* Round output to a clean, human-readable figure
-
-### R14. Current Income (Context Only)
-* Ask approximate income (monthly or annual)
-* Normalize internally to annual
-* Use only for plausibility checks and explanation
-
----
-
-## IMPORTANT: DATA COLLECTION COMPLETION
-
-When you have collected ALL the following inputs, output CALCULATION_READY followed by a JSON block:
-1. current_age (number)
-2. retirement_age (number)
-3. life_expectancy (number, default 85)
-4. current_annual_expenses (number - normalized to annual)
-5. current_investments (number)
-6. current_annual_income (number - normalized to annual)
-7. risk_profile (string: conservative, moderate, or aggressive)
-8. dependents (string: self_spouse, children, parents, combination, not_sure)
-
-Format when ALL data collected:
+# System prompt based on the updated specification
+SYSTEM_PROMPT = """Today is 03 Feb 2026.
+You are a goal-based financial planning assistant for retirement planning only (Excel-wired, conversation-driven, deterministic).
+You are not a product recommender, tax advisor or portfolio constructor.
+
+Objective:
+- Run a structured multi-turn conversation that collects all materially relevant inputs, with no hidden assumptions
+- The Excel model is the single source of calculation truth; do NOT provide the final calculation yourself
+
+Rules:
+- One goal per session; one question per turn; conversation first, calculation last
+- No silent assumptions; "I don't know" gets a safe default that you disclose
+- Normalize all monetary inputs to annual; always confirm whether expenses/income are monthly or annual
+- Convert lakhs/crores to numbers (1 lakh = 100000, 1 crore = 10000000)
+- Ask for clarification on ambiguous answers
+- Each conversation is a new user; assume no prior context
+- Tone: warm, professional, empathetic, jargon-free, patient; no sales language or product recommendations
+
+Collect, in order:
+- R1 Current age (or DOB, then compute age)
+- R2 Desired retirement age; suggest 55-65; must be greater than current age
+- R4 Age savings should last until (life expectancy); default 85 if unknown, and disclose
+- R5 Dependents in retirement: self/spouse only, children, parents, combination, not sure
+- R6 Current living expenses (mandatory, total only, no line items); confirm monthly vs annual
+- R10 Total current investment portfolio value (mandatory, treated as retirement savings, zero allowed)
+- R12 Risk profile (mandatory): conservative (8%), moderate/balanced (12%), aggressive (15%)
+- R14 Approximate current income (monthly or annual), used only for plausibility
+
+Locked assumptions: inflation 6%; same return rate pre- and post-retirement; FV-based constant monthly SIP, no step-ups; planning-level estimates only.
+
+When ALL inputs are collected, output CALCULATION_READY followed by exactly this JSON (annual amounts):
 CALCULATION_READY
 ```json
-{
-    "current_age": <number>,
-    "retirement_age": <number>,
-    "life_expectancy": <number>,
-    "current_annual_expenses": <number>,
-    "current_investments": <number>,
-    "current_annual_income": <number>,
-    "risk_profile": "<conservative|moderate|aggressive>",
-    "dependents": "<self_spouse|children|parents|combination|not_sure>"
-}
+{"current_age": <number>, "retirement_age": <number>, "life_expectancy": <number>, "current_annual_expenses": <number>, "current_investments": <number>, "current_annual_income": <number>, "risk_profile": "<conservative|moderate|aggressive>", "dependents": "<self_spouse|children|parents|combination|not_sure>"}
 ```
-
----
-
-## TONE & BEHAVIOR
-- Warm, professional, and trustworthy
-- No sales language or product recommendations
-- Empathetic to financial concerns
-- Clear and jargon-free explanations
-- Patient with unclear answers
-
-## IMPORTANT NOTES:
-- Do NOT provide the final calculation - just collect the data
-- When you have ALL required inputs, output CALCULATION_READY with the JSON
-- If user provides ambiguous data, ask for clarification
-- Convert any "lakhs" or "crores" mentioned to actual numbers (1 lakh = 100000, 1 crore = 10000000)
-- Always confirm if expense/income values are monthly or annual before normalizing
-- Each new conversation is a new user - do not assume any prior context
 """
 
+SYSTEM_MSG = {"role": "system", "content": SYSTEM_PROMPT}
+
+# Patterns used on every chat turn, compiled once
+_JSON_BLOCK_RE = re.compile(r'```json\s*(.*?)\s*```', re.DOTALL)
+_JSON_BARE_RE = re.compile(r'\{[^{}]*\}', re.DOTALL)
+_AGE_RE = re.compile(r'retire\s*(?:early\s*)?(?:at|when|by)?\s*(\d{2})')
+# A bare "what if I retire at 58?"-style question with nothing else asked
+_WHATIF_ONLY_RE = re.compile(
+    r'^(?:(?:and|so|ok|okay)[,\s]+)?(?:what\s+(?:if|about)\s+|if\s+)?(?:i\s+)?'
+    r'(?:(?:want\s+to|were\s+to|decide\s+to|choose\s+to)\s+)?'
+    r'retire\s*(?:early\s*)?(?:at|when|by)?\s*(\d{2})'
+    r'(?:\s*(?:years?(?:\s+old)?|instead))*\s*[?.!]*$'
+)
+
 # What-if system prompt addition
 WHATIF_SYSTEM_PROMPT = """
 You are helping with what-if scenario analysis for a retirement plan.
@@ -523,83 +149,209 @@ Include this disclosure:
 
 
 def init_session_state():
-    """Initialize session state variables"""
-    if "messages" not in st.session_state:
-        st.session_state.messages = []
-
-    if "calculation_done" not in st.session_state:
-        st.session_state.calculation_done = False
-
-    if "result" not in st.session_state:
-        st.session_state.result = None
-
-    if "inputs" not in st.session_state:
-        st.session_state.inputs = None
-
-    if "collected_data" not in st.session_state:
-        st.session_state.collected_data = None
-
-    if "openai_client" not in st.session_state:
-        st.session_state.openai_client = None
-
-    if "whatif_mode" not in st.session_state:
-        st.session_state.whatif_mode = False
-
-    if "followup_messages" not in st.session_state:
-        st.session_state.followup_messages = []
-
+    """Initialize session state variables (once per session)"""
+    if st.session_state.get("_initialized"):
+        return
 
+    st.session_state.update({
+        "messages": [],
+        "gpt_messages": [],
+        "calculation_done": False,
+        "result": None,
+        "inputs": None,
+        "collected_data": None,
+        "followup_messages": [],
+        "followup_summary": "",
+        "followup_summarized": 0,
+        "_initialized": True
+    })
+
+
+@st.cache_resource
 def get_openai_client():
-    """Get or create OpenAI client from environment variable"""
-    if st.session_state.openai_client is None:
-        api_key = os.getenv("OPENAI_API_KEY")
-        if api_key:
-            st.session_state.openai_client = OpenAI(api_key=api_key)
-    return st.session_state.openai_client
+    """Get the shared OpenAI client, created once per process from the environment"""
+    api_key = os.getenv("OPENAI_API_KEY")
+    if api_key:
+        return OpenAI(api_key=api_key)
+    return None
+
 
+@st.cache_resource(ttl=CHAT_CACHE_TTL)
+def _reply_cache() -> tuple:
+    """
+    (replies, lock): completed replies keyed by (role, content) pairs + max_tokens,
+    and the lock guarding them; both are process-wide and dropped together after the TTL
+    """
+    return {}, threading.Lock()
+
+
+def stream_completion(client: OpenAI, messages: list, max_tokens: int):
+    """
+    Yield GPT-4o response text incrementally as tokens arrive
+    An identical conversation seen before replays its cached reply without an API call
+    """
+    key = (tuple((m["role"], m["content"]) for m in messages), max_tokens)
+    cache, lock = _reply_cache()
+    cached = cache.get(key)
+    if cached is not None:
+        yield cached
+        return
 
-def chat_with_gpt(messages: list, system_prompt: str = SYSTEM_PROMPT) -> str:
-    """Send messages to GPT-4o and get response"""
+    stream = client.chat.completions.create(
+        model="gpt-4o",
+        messages=messages,
+        temperature=0.7,
+        max_tokens=max_tokens,
+        stream=True
+    )
+    parts = []
+    for chunk in stream:
+        if chunk.choices:
+            text = chunk.choices[0].delta.content or ""
+            parts.append(text)
+            yield text
+
+    # Only fully received replies are cached; errors raise before reaching here
+    # The dict is shared by every session thread, so evict and insert under a lock
+    with lock:
+        if len(cache) >= CHAT_CACHE_MAX_ENTRIES:
+            cache.pop(next(iter(cache), None), None)
+        cache[key] = "".join(parts)
+
+
+def chat_with_gpt_stream(messages: list, system_prompt: str = SYSTEM_PROMPT,
+                         max_tokens: int = MAX_TOKENS_COLLECT):
+    """Send messages to GPT-4o and stream the response"""
     client = get_openai_client()
     if not client:
-        return "Error: OpenAI API key not found. Please add OPENAI_API_KEY to your .env file."
+        yield "Error: OpenAI API key not found. Please add OPENAI_API_KEY to your .env file."
+        return
+
+    if system_prompt is SYSTEM_PROMPT:
+        system_msg = SYSTEM_MSG
+    else:
+        system_msg = {"role": "system", "content": system_prompt}
+
+    outgoing = [system_msg]
+    outgoing += messages
 
     try:
-        response = client.chat.completions.create(
+        yield from stream_completion(client, outgoing, max_tokens)
+    except Exception as e:
+        yield f"Error communicating with GPT-4o: {str(e)}"
+
+
+def stream_until_sentinel(chunks, reply_parts: list):
+    """
+    Yield the displayable part of a streamed reply, stopping at CALC_SENTINEL
+    Every chunk, including the hidden marker and JSON payload, is collected in reply_parts
+    """
+    pending = ""
+    hidden = False
+    for chunk in chunks:
+        reply_parts.append(chunk)
+        if hidden:
+            continue
+        pending += chunk
+        marker = pending.find(CALC_SENTINEL)
+        if marker != -1:
+            hidden = True
+            yield pending[:marker]
+            continue
+        # Hold back only a tail that could be the start of a marker split across chunks
+        keep = next((k for k in range(min(len(pending), len(CALC_SENTINEL) - 1), 0, -1)
+                     if CALC_SENTINEL.startswith(pending[-k:])), 0)
+        if len(pending) > keep:
+            yield pending[:len(pending) - keep]
+            pending = pending[len(pending) - keep:]
+    if not hidden and pending:
+        yield pending
+
+
+async def chat_with_gpt_async(client: AsyncOpenAI, messages: list, system_prompt: str,
+                              max_tokens: int) -> str:
+    """Send messages to GPT-4o from inside an event loop and get the full response"""
+    try:
+        response = await client.chat.completions.create(
             model="gpt-4o",
             messages=[{"role": "system", "content": system_prompt}] + messages,
             temperature=0.7,
-            max_tokens=1500
+            max_tokens=max_tokens
         )
         return response.choices[0].message.content
     except Exception as e:
         return f"Error communicating with GPT-4o: {str(e)}"
 
 
+def chat_with_gpt_many(conversations: list, system_prompt: str = WHATIF_SYSTEM_PROMPT,
+                       max_tokens: int = MAX_TOKENS_WHATIF) -> list:
+    """
+    Run independent GPT-4o calls concurrently, e.g. one narration per what-if scenario
+    Latency is that of the slowest call rather than the sum of all of them
+    """
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        return ["Error: OpenAI API key not found."] * len(conversations)
+
+    async def run_all():
+        # The async client is bound to this event loop, so it is not cached across runs
+        async with AsyncOpenAI(api_key=api_key) as client:
+            return await asyncio.gather(*(
+                chat_with_gpt_async(client, messages, system_prompt, max_tokens)
+                for messages in conversations
+            ))
+
+    return asyncio.run(run_all())
+
+
 def extract_calculation_data(response: str) -> dict:
     """Extract JSON data from CALCULATION_READY response"""
-    if "CALCULATION_READY" not in response:
+    marker = response.find(CALC_SENTINEL)
+    if marker == -1:
         return None
 
+    # Fast path: a single JSON object follows the marker
+    start = response.find("{", marker)
+    end = response.rfind("}")
+    if start != -1 and end > start:
+        try:
+            return orjson.loads(response[start:end + 1])
+        except orjson.JSONDecodeError:
+            pass
+
     # Find JSON in the response
-    json_match = re.search(r'```json\s*(.*?)\s*```', response, re.DOTALL)
+    json_match = _JSON_BLOCK_RE.search(response)
     if json_match:
         try:
-            return json.loads(json_match.group(1))
-        except json.JSONDecodeError:
+            return orjson.loads(json_match.group(1))
+        except orjson.JSONDecodeError:
             pass
 
     # Try to find JSON without code blocks
-    json_match = re.search(r'\{[^{}]*\}', response, re.DOTALL)
+    json_match = _JSON_BARE_RE.search(response)
     if json_match:
         try:
-            return json.loads(json_match.group(0))
-        except json.JSONDecodeError:
+            return orjson.loads(json_match.group(0))
+        except orjson.JSONDecodeError:
             pass
 
     return None
 
 
+def build_assistant_message(response: str) -> dict:
+    """
+    Chat message dict for an assistant reply
+    The CALCULATION_READY split is done once here so reruns never rescan the history
+    """
+    message = {"role": "assistant", "content": response}
+    marker = response.find(CALC_SENTINEL)
+    if marker != -1:
+        message["display_content"] = response[:marker].strip()
+        message["calc_json"] = extract_calculation_data(response)
+    return message
+
+
+@st.cache_data(show_spinner=False, ttl=PLAN_CACHE_TTL)
 def perform_calculation(data: dict):
     """Perform retirement calculation with collected data"""
     inputs = RetirementInputs(
@@ -618,12 +370,48 @@ def perform_calculation(data: dict):
     return result, inputs
 
 
+@dataclass(frozen=True)
+class ResultView:
+    """Display strings for a RetirementResult, formatted once per plan"""
+    current_exp_str: str
+    current_income_str: str
+    current_inv_str: str
+    future_exp_str: str
+    corpus_str: str
+    future_inv_str: str
+    gap_str: str
+    sip_str: str
+
+
+@st.cache_data(show_spinner=False, ttl=PLAN_CACHE_TTL)
+def build_view(_result: RetirementResult, _inputs: RetirementInputs, inputs_key: tuple) -> ResultView:
+    """Format the plan's currency figures once, cached on inputs_key"""
+    result, inputs = _result, _inputs
+    return ResultView(
+        current_exp_str=format_currency(result.current_annual_expenses),
+        current_income_str=format_currency(result.current_annual_income) if result.current_annual_income > 0 else "Not provided",
+        current_inv_str=format_currency(inputs.current_investments),
+        future_exp_str=format_currency(result.future_annual_expenses),
+        corpus_str=format_currency(result.corpus_required),
+        future_inv_str=format_currency(result.future_investment_value),
+        gap_str=format_currency(result.corpus_gap),
+        sip_str=format_currency(result.monthly_savings_rounded)
+    )
+
+
+@st.cache_data(show_spinner=False, ttl=PLAN_CACHE_TTL)
+def build_excel_bytes(inputs_tuple: tuple) -> bytes:
+    """Excel plan bytes, cached on the RetirementInputs field values"""
+    inputs = RetirementInputs(*inputs_tuple)
+    return generate_excel_plan(calculate_retirement_plan(inputs), inputs)
+
+
 # Follow-up chat system prompt
+# Kept byte-identical across users and turns so OpenAI's prompt cache can reuse it;
+# everything plan- or question-specific goes in later messages
 FOLLOWUP_SYSTEM_PROMPT = """
 You are a helpful retirement planning assistant. The user has already completed their retirement plan and now has follow-up questions.
-
-## CONTEXT - USER'S RETIREMENT PLAN
-{plan_context}
+The user's plan details are provided in the next message.
 
 ## YOUR ROLE
 1. Answer questions about the retirement plan results
@@ -637,14 +425,14 @@ When users ask what-if questions about retirement age:
 - Calculate the new scenario using the same assumptions
 - Present comparison: Base Plan vs What-If
 - Explain why the numbers changed
-- Use this format:
+- Use this format (base values are the plan context's Retirement Age and Monthly SIP Required):
 
-**Base Plan (Retire at {base_age}):**
-- Monthly SIP: {base_sip}
+**Base Plan (Retire at [Retirement Age]):**
+- Monthly SIP: [Monthly SIP Required]
 
-**What-if: Retire at {new_age}:**
-- Monthly SIP: {new_sip}
-- Difference: {difference}
+**What-if: Retire at [age the user asked about]:**
+- Monthly SIP: [New Monthly SIP Required]
+- Difference: [Difference from Base Plan]
 - Reason: [Shorter/Longer] accumulation period
 
 ## RULES
@@ -655,97 +443,270 @@ When users ask what-if questions about retirement age:
 5. Be helpful, clear, and concise
 
 ## AVAILABLE DATA
-You have access to all the plan details shown in the context above. Use specific numbers when answering questions.
+You have access to all the plan details shown in the plan context message. Use specific numbers when answering questions.
+When a WHAT-IF CALCULATION RESULT message is present, use its numbers for the what-if side of the comparison.
 """
 
+FOLLOWUP_SYSTEM_MSG = {"role": "system", "content": FOLLOWUP_SYSTEM_PROMPT}
+
+# Heading for the per-plan context message (the system prompt refers to its fields by name)
+_FOLLOWUP_PREFIX = "## CONTEXT - USER'S RETIREMENT PLAN\n"
 
-def get_plan_context(result: RetirementResult, inputs: RetirementInputs) -> str:
-    """Generate context string for follow-up chat"""
-    return f"""
+# Follow-up plan context; only the per-plan fields are substituted
+_PLAN_CTX_TMPL = Template("""
 RETIREMENT PLAN DETAILS:
-- Current Age: {result.current_age} years
-- Retirement Age: {result.retirement_age} years
-- Life Expectancy: {result.life_expectancy} years
-- Years to Retirement: {result.years_to_retirement} years
-- Retirement Duration: {result.retirement_duration} years
-- Risk Profile: {result.risk_profile.capitalize()}
+- Current Age: $current_age years
+- Retirement Age: $retirement_age years
+- Life Expectancy: $life_expectancy years
+- Years to Retirement: $years_to_retirement years
+- Retirement Duration: $retirement_duration years
+- Risk Profile: $risk_profile
 
 FINANCIAL DETAILS:
-- Current Annual Expenses: {format_currency(result.current_annual_expenses)}
-- Current Annual Income: {format_currency(result.current_annual_income) if result.current_annual_income > 0 else 'Not provided'}
-- Current Investments: {format_currency(inputs.current_investments)}
-- Living Expenses at Retirement: {format_currency(result.future_annual_expenses)}/year
-- Corpus Required: {format_currency(result.corpus_required)}
-- Future Value of Current Investments: {format_currency(result.future_investment_value)}
-- Corpus Gap: {format_currency(result.corpus_gap)}
-- Monthly SIP Required: {format_currency(result.monthly_savings_rounded)}
+- Current Annual Expenses: $current_exp
+- Current Annual Income: $current_income
+- Current Investments: $current_inv
+- Living Expenses at Retirement: $future_exp/year
+- Corpus Required: $corpus
+- Future Value of Current Investments: $future_inv
+- Corpus Gap: $gap
+- Monthly SIP Required: $sip
 
 ASSUMPTIONS:
-- Inflation Rate: {result.inflation_rate * 100:.0f}% per annum
-- Expected Return Rate: {result.expected_return_rate * 100:.0f}% per annum
+- Inflation Rate: $inflation_pct% per annum
+- Expected Return Rate: $return_pct% per annum
 - Same return rate applied pre- and post-retirement
 - Constant monthly SIP (no step-ups)
-"""
+""")
+
+
+@st.cache_data(show_spinner=False, ttl=PLAN_CACHE_TTL)
+def get_plan_context(_result: RetirementResult, _inputs: RetirementInputs, inputs_key: tuple) -> str:
+    """
+    Generate context string for follow-up chat
+    Cached on inputs_key (the RetirementInputs fields), which fully determines the result
+    """
+    result = _result
+    view = build_view(_result, _inputs, inputs_key)
+    return _PLAN_CTX_TMPL.substitute(
+        current_age=result.current_age,
+        retirement_age=result.retirement_age,
+        life_expectancy=result.life_expectancy,
+        years_to_retirement=result.years_to_retirement,
+        retirement_duration=result.retirement_duration,
+        risk_profile=result.risk_profile.capitalize(),
+        current_exp=view.current_exp_str,
+        current_income=view.current_income_str,
+        current_inv=view.current_inv_str,
+        future_exp=view.future_exp_str,
+        corpus=view.corpus_str,
+        future_inv=view.future_inv_str,
+        gap=view.gap_str,
+        sip=view.sip_str,
+        inflation_pct=f"{result.inflation_rate * 100:.0f}",
+        return_pct=f"{result.expected_return_rate * 100:.0f}"
+    )
+
+
+# Locally rendered answer for pure what-if questions (no GPT call needed)
+WHATIF_REPLY_TEMPLATE = """**What-if comparison**
+
+**Base Plan (Retire at {base_age}):**
+- Monthly SIP: {base_sip}
+- Corpus Required: {base_corpus}
+
+**What-if: Retire at {new_age}:**
+- Monthly SIP: {new_sip}
+- Difference: {difference}
+- Corpus Required: {new_corpus}
+- Reason: {reason}
+
+> These what-if scenarios are illustrative comparisons based on the same assumptions as your base plan.
+> They are meant to show directional impact, not to replace the original plan."""
+
+# Local reply for what-if ages the plan cannot model
+WHATIF_PAST_LIFE_REPLY = """Retiring at **{new_age}** is at or beyond the life expectancy used in your plan (**{life_expectancy}**), so there are no retirement years to fund and no meaningful what-if figures to show.
+
+Try a retirement age below {life_expectancy}, or tell me if you'd like to plan with a longer life expectancy."""
+
+
+SUMMARY_PROMPT = """Summarize this retirement-planning follow-up conversation in under 120 words.
+Keep the questions asked, any what-if ages discussed with their numbers, and open concerns.
+Merge it with the existing summary if one is given."""
+
+
+def summarize_turns(client: OpenAI, summary: str, turns: list) -> str:
+    """Fold older follow-up turns into the running conversation summary"""
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in turns)
+    response = client.chat.completions.create(
+        model="gpt-4o",
+        messages=[
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": f"Existing summary:\n{summary or 'None'}\n\nNew turns:\n{transcript}"}
+        ],
+        temperature=0,
+        max_tokens=MAX_TOKENS_SUMMARY
+    )
+    return response.choices[0].message.content
+
 
+# After a failed tokenizer load, fall back to the len/4 estimate for this long before retrying
+ENC_RETRY_SECONDS = 5 * 60
 
-def chat_followup(user_message: str, result: RetirementResult, inputs: RetirementInputs) -> str:
-    """Handle follow-up chat questions about the retirement plan"""
+
+@st.cache_resource
+def _load_enc():
+    """Shared gpt-4o tokenizer; raises are not cached, so a failed load can be retried"""
+    import tiktoken
+    return tiktoken.encoding_for_model("gpt-4o")
+
+
+@st.cache_resource
+def _enc_state() -> dict:
+    """Process-wide tokenizer load status (survives reruns, unlike a script global)"""
+    return {"failed_at": None}
+
+
+def _enc():
+    """Shared gpt-4o tokenizer, or None if tiktoken or its encoding file is unavailable"""
+    state = _enc_state()
+    failed_at = state["failed_at"]
+    if failed_at is not None and time.monotonic() - failed_at < ENC_RETRY_SECONDS:
+        return None
+    try:
+        enc = _load_enc()
+    except Exception:
+        # Missing package, or the encoding could not be downloaded
+        state["failed_at"] = time.monotonic()
+        return None
+    state["failed_at"] = None
+    return enc
+
+
+def count_tokens(message: dict) -> int:
+    """Token count of a chat message, computed once and stored on the message as _tok"""
+    if "_tok" not in message:
+        enc = _enc()
+        content = message["content"]
+        # encode_ordinary: user text like "<|endoftext|>" is counted, not rejected
+        message["_tok"] = len(enc.encode_ordinary(content)) if enc else len(content) // 4
+    return message["_tok"]
+
+
+def followup_history(client: OpenAI) -> list:
+    """
+    Recent follow-up turns to send verbatim, bounded by FOLLOWUP_HISTORY_WINDOW
+    messages and FOLLOWUP_TOKEN_BUDGET tokens
+    Once the unsummarized history overflows the window, all but the newest half
+    is summarized in a single call, so the summary is refreshed every few turns
+    rather than on every message
+    """
+    history = st.session_state.followup_messages
+    start = st.session_state.followup_summarized
+
+    if len(history) - start > FOLLOWUP_HISTORY_WINDOW:
+        end = len(history) - FOLLOWUP_HISTORY_WINDOW // 2
+        try:
+            st.session_state.followup_summary = summarize_turns(
+                client, st.session_state.followup_summary, history[start:end]
+            )
+            st.session_state.followup_summarized = start = end
+        except Exception:
+            # Keep going with the recent window only
+            start = len(history) - FOLLOWUP_HISTORY_WINDOW
+
+    # Trim the oldest turns until the window fits the token budget
+    window = history[start:]
+    total = sum(count_tokens(m) for m in window)
+    while window and total > FOLLOWUP_TOKEN_BUDGET:
+        total -= window.pop(0)["_tok"]
+
+    return [{"role": m["role"], "content": m["content"]} for m in window]
+
+
+def chat_followup_stream(user_message: str, result: RetirementResult, inputs: RetirementInputs):
+    """Handle follow-up chat questions about the retirement plan, streaming the answer"""
     client = get_openai_client()
     if not client:
-        return "Error: OpenAI API key not found."
-
-    # Build context-aware system prompt
-    plan_context = get_plan_context(result, inputs)
-    system_prompt = FOLLOWUP_SYSTEM_PROMPT.format(
-        plan_context=plan_context,
-        base_age=result.retirement_age,
-        base_sip=format_currency(result.monthly_savings_rounded),
-        new_age="{user_specified_age}",
-        new_sip="{calculated_sip}",
-        difference="{calculated_difference}"
-    )
+        yield "Error: OpenAI API key not found."
+        return
+
+    # Build the plan context message (follows the static system prompt)
+    inputs_key = astuple(inputs)
+    view = build_view(result, inputs, inputs_key)
+    plan_context = get_plan_context(result, inputs, inputs_key)
+    context_msg = {"role": "system", "content": f"{_FOLLOWUP_PREFIX}{plan_context}"}
+
+    max_tokens = MAX_TOKENS_FOLLOWUP
+    whatif_info = None
 
     # Check if user is asking about a specific retirement age
-    age_match = re.search(r'retire\s*(?:at|when|by)?\s*(\d{2})', user_message.lower())
+    age_match = _AGE_RE.search(user_message.lower())
     if age_match:
         new_age = int(age_match.group(1))
-        if new_age > inputs.current_age and new_age != result.retirement_age:
+        if new_age >= inputs.life_expectancy and new_age > inputs.current_age:
+            # No retirement years left to fund: there are no meaningful what-if figures
+            if _WHATIF_ONLY_RE.match(user_message.strip().lower()):
+                yield WHATIF_PAST_LIFE_REPLY.format(
+                    new_age=new_age,
+                    life_expectancy=inputs.life_expectancy
+                )
+                return
+            whatif_info = (f"The user asked about retiring at {new_age}, which is at or beyond the plan's "
+                           f"life expectancy of {inputs.life_expectancy}. No what-if figures apply; "
+                           f"do not quote SIP or corpus numbers for that age.")
+            max_tokens = MAX_TOKENS_WHATIF
+        elif new_age > inputs.current_age and new_age != result.retirement_age:
             whatif_result = calculate_whatif_scenario(inputs, new_age)
             diff = whatif_result.monthly_savings_rounded - result.monthly_savings_rounded
-            diff_sign = "+" if diff > 0 else ""
+            diff_sign = "+" if diff > 0 else "-" if diff < 0 else ""
             reason = "shorter accumulation period and longer retirement" if new_age < result.retirement_age else "longer accumulation period and shorter retirement"
 
-            whatif_info = f"""
-
-WHAT-IF CALCULATION RESULT:
+            whatif_info = f"""WHAT-IF CALCULATION RESULT:
 - New Retirement Age: {new_age}
 - New Monthly SIP Required: {format_currency(whatif_result.monthly_savings_rounded)}
 - Difference from Base Plan: {diff_sign}{format_currency(abs(diff))}
 - New Corpus Required: {format_currency(whatif_result.corpus_required)}
 - Reason: {reason}
 """
-            system_prompt += whatif_info
+            # Pure what-if question: the answer is fully determined locally
+            if _WHATIF_ONLY_RE.match(user_message.strip().lower()):
+                yield WHATIF_REPLY_TEMPLATE.format(
+                    base_age=result.retirement_age,
+                    base_sip=view.sip_str,
+                    base_corpus=view.corpus_str,
+                    new_age=new_age,
+                    new_sip=format_currency(whatif_result.monthly_savings_rounded),
+                    difference=f"{diff_sign}{format_currency(abs(diff))}",
+                    new_corpus=format_currency(whatif_result.corpus_required),
+                    reason=reason.capitalize()
+                )
+                return
 
-    # Build messages for API call
-    messages = [{"role": "system", "content": system_prompt}]
+            max_tokens = MAX_TOKENS_WHATIF
 
-    # Add conversation history
-    for msg in st.session_state.followup_messages:
-        messages.append({"role": msg["role"], "content": msg["content"]})
+    # Build messages for API call: static prefix first, most volatile content last
+    messages = [FOLLOWUP_SYSTEM_MSG, context_msg]
+
+    # Add summary of older turns, then the recent conversation window
+    if st.session_state.followup_summary:
+        messages.append({
+            "role": "system",
+            "content": f"Summary of earlier follow-up conversation:\n{st.session_state.followup_summary}"
+        })
+    messages += followup_history(client)
+
+    # Add this turn's what-if numbers right before the question they answer
+    if whatif_info:
+        messages.append({"role": "system", "content": whatif_info})
 
     # Add current user message
     messages.append({"role": "user", "content": user_message})
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=messages,
-            temperature=0.7,
-            max_tokens=1000
-        )
-        return response.choices[0].message.content
+        yield from stream_completion(client, messages, max_tokens)
     except Exception as e:
-        return f"Error: {str(e)}"
+        yield f"Error: {str(e)}"
 
 
 def display_goal_summary(result: RetirementResult, inputs: RetirementInputs):
@@ -788,7 +749,7 @@ def display_goal_summary(result: RetirementResult, inputs: RetirementInputs):
         """, unsafe_allow_html=True)
 
 
-def display_authoritative_numbers(result: RetirementResult):
+def display_authoritative_numbers(view: ResultView):
     """Section B: Authoritative Numbers"""
     st.markdown('<p class="section-header">B. Authoritative Numbers</p>', unsafe_allow_html=True)
 
@@ -798,14 +759,11 @@ def display_authoritative_numbers(result: RetirementResult):
         st.markdown(f"""
         <div class="metric-card">
             <div class="metric-label">Living Expenses at Retirement</div>
-            <div class="metric-value">{format_currency(result.future_annual_expenses)}/year</div>
+            <div class="metric-value">{view.future_exp_str}/year</div>
         </div>
-        """, unsafe_allow_html=True)
-
-        st.markdown(f"""
         <div class="metric-card">
             <div class="metric-label">Corpus Gap</div>
-            <div class="metric-value">{format_currency(result.corpus_gap)}</div>
+            <div class="metric-value">{view.gap_str}</div>
         </div>
         """, unsafe_allow_html=True)
 
@@ -813,32 +771,28 @@ def display_authoritative_numbers(result: RetirementResult):
         st.markdown(f"""
         <div class="metric-card">
             <div class="metric-label">Corpus Required</div>
-            <div class="metric-value">{format_currency(result.corpus_required)}</div>
+            <div class="metric-value">{view.corpus_str}</div>
         </div>
-        """, unsafe_allow_html=True)
-
-        st.markdown(f"""
         <div class="metric-card-highlight">
             <div class="metric-label">Monthly SIP Required</div>
-            <div class="metric-value">{format_currency(result.monthly_savings_rounded)}</div>
+            <div class="metric-value">{view.sip_str}</div>
         </div>
         """, unsafe_allow_html=True)
 
 
-def display_explanation(result: RetirementResult, inputs: RetirementInputs):
+def display_explanation(result: RetirementResult, view: ResultView):
     """Section C: Explanation"""
     st.markdown('<p class="section-header">C. Why This Monthly Amount?</p>', unsafe_allow_html=True)
 
     explanation_parts = [
         f"**Time Horizon:** You have {result.years_to_retirement} years until retirement at age {result.retirement_age}.",
-        f"**Inflation Impact:** Your current annual expenses of {format_currency(result.current_annual_expenses)} will grow to {format_currency(result.future_annual_expenses)} at retirement (6% inflation).",
+        f"**Inflation Impact:** Your current annual expenses of {view.current_exp_str} will grow to {view.future_exp_str} at retirement (6% inflation).",
         f"**Expense Escalation:** During {result.retirement_duration} years of retirement, expenses continue to rise with inflation.",
         f"**Return Assumption:** Based on your {result.risk_profile} risk profile, we assume {result.expected_return_rate * 100:.0f}% annual returns both before and after retirement.",
-        f"**FV-based SIP Logic:** To accumulate the corpus gap of {format_currency(result.corpus_gap)}, you need to invest {format_currency(result.monthly_savings_rounded)} monthly using a constant SIP approach."
+        f"**FV-based SIP Logic:** To accumulate the corpus gap of {view.gap_str}, you need to invest {view.sip_str} monthly using a constant SIP approach."
     ]
 
-    for part in explanation_parts:
-        st.markdown(f"- {part}")
+    st.markdown("\n".join(f"- {part}" for part in explanation_parts))
 
     # Income vs Expense flag
     if result.income_expense_flag:
@@ -854,10 +808,8 @@ def display_assumptions(result: RetirementResult):
     """Section D: Assumptions"""
     st.markdown('<p class="section-header">D. Assumptions (Explicit)</p>', unsafe_allow_html=True)
 
-    st.markdown('<div class="assumption-box">', unsafe_allow_html=True)
-    for assumption in result.assumptions:
-        st.markdown(f"• {assumption}")
-    st.markdown('</div>', unsafe_allow_html=True)
+    bullets = "<br>".join(f"• {assumption}" for assumption in result.assumptions)
+    st.markdown(f'<div class="assumption-box">{bullets}</div>', unsafe_allow_html=True)
 
 
 def display_disclaimers():
@@ -891,72 +843,79 @@ def display_next_steps():
     """, unsafe_allow_html=True)
 
 
-def display_whatif_scenarios(inputs: RetirementInputs, base_result: RetirementResult):
+# What-if card markup, filled per scenario with format_map
+_WHATIF_CARD_TMPL = """<div class="whatif-card">
+    <strong>What-if: Retire at {age}</strong><br>
+    Monthly SIP: <strong style="color: #D1A36C;">{sip}</strong><br>
+    <span style="color: {color};">({diff_sign}{diff})</span><br>
+    <small style="color: #8B8D98;"><em>Reason: {reason}</em></small>
+</div>"""
+
+_WHATIF_DISCLAIMER_HTML = """
+<div class="disclaimer-box">
+    <em>These what-if scenarios are illustrative comparisons based on the same assumptions as your base plan.
+    They are meant to show directional impact, not to replace the original plan.</em><br><br>
+    If you'd like, we can convert one of these scenarios into a full plan by re-running the analysis.
+</div>
+"""
+
+
+def display_whatif_scenarios(inputs: RetirementInputs, base_result: RetirementResult, view: ResultView):
     """Display what-if scenario comparisons"""
     st.markdown('<p class="section-header">What-If Scenarios</p>', unsafe_allow_html=True)
 
     st.info("Compare how different retirement ages affect your monthly savings requirement.")
 
-    # Generate scenarios for different retirement ages
-    scenarios = []
-    for age in [55, 58, 60, 62, 65]:
-        if age > inputs.current_age and age != inputs.retirement_age:
-            scenario = calculate_whatif_scenario(inputs, age)
-            scenarios.append({
-                "age": age,
-                "result": scenario
-            })
+    # Scenarios for the standard retirement ages, computed with the base plan
+    scenarios = [
+        {"age": age, "monthly_savings_rounded": scenario.monthly_savings_rounded}
+        for age, scenario in base_result.whatif_scenarios.items()
+        if age != inputs.retirement_age
+    ]
 
     # Display base plan
     st.markdown(f"""
     <div class="whatif-card-base">
         <strong>📌 Base Plan (Retire at {base_result.retirement_age})</strong><br>
-        Monthly SIP Required: <strong>{format_currency(base_result.monthly_savings_rounded)}</strong>
+        Monthly SIP Required: <strong>{view.sip_str}</strong>
     </div>
     """, unsafe_allow_html=True)
 
-    # Display scenarios
-    cols = st.columns(min(len(scenarios), 3))
-    for i, scenario in enumerate(scenarios[:3]):
-        with cols[i % 3]:
-            diff = scenario["result"].monthly_savings_rounded - base_result.monthly_savings_rounded
-            diff_sign = "+" if diff > 0 else ""
-            diff_color = "#bf6a6a" if diff > 0 else "#6abf6a"
-
-            reason = "Shorter accumulation period" if scenario["age"] < base_result.retirement_age else "Longer accumulation period"
-
-            st.markdown(f"""
-            <div class="whatif-card">
-                <strong>What-if: Retire at {scenario["age"]}</strong><br>
-                Monthly SIP: <strong style="color: #D1A36C;">{format_currency(scenario["result"].monthly_savings_rounded)}</strong><br>
-                <span style="color: {diff_color};">({diff_sign}{format_currency(abs(diff))})</span><br>
-                <small style="color: #8B8D98;"><em>Reason: {reason}</em></small>
-            </div>
-            """, unsafe_allow_html=True)
+    # Display up to three scenarios side by side in a single element
+    cards = []
+    for scenario in scenarios[:3]:
+        diff = scenario["monthly_savings_rounded"] - base_result.monthly_savings_rounded
+        cards.append(_WHATIF_CARD_TMPL.format_map({
+            "age": scenario["age"],
+            "sip": format_currency(scenario["monthly_savings_rounded"]),
+            "color": "#bf6a6a" if diff > 0 else "#6abf6a",
+            "diff_sign": "+" if diff > 0 else "-" if diff < 0 else "",
+            "diff": format_currency(abs(diff)),
+            "reason": "Shorter accumulation period" if scenario["age"] < base_result.retirement_age else "Longer accumulation period"
+        }))
+    st.markdown(f'<div class="whatif-grid">{"".join(cards)}</div>', unsafe_allow_html=True)
 
-    st.markdown("""
-    <div class="disclaimer-box">
-        <em>These what-if scenarios are illustrative comparisons based on the same assumptions as your base plan.
-        They are meant to show directional impact, not to replace the original plan.</em><br><br>
-        If you'd like, we can convert one of these scenarios into a full plan by re-running the analysis.
-    </div>
-    """, unsafe_allow_html=True)
+    st.markdown(_WHATIF_DISCLAIMER_HTML, unsafe_allow_html=True)
 
 
+@st.fragment
 def display_result_card(result: RetirementResult, inputs: RetirementInputs):
-    """Display the complete retirement planning result"""
+    """
+    Display the complete retirement planning result
+    Runs as a fragment so widget interaction inside the card doesn't rerun the chat below it
+    """
+    view = build_view(result, inputs, astuple(inputs))
 
-    st.markdown("---")
-    st.markdown('<h2 style="color: #D1A36C; text-align: center;">🎯 Your Retirement Plan</h2>', unsafe_allow_html=True)
+    st.markdown('---\n<h2 style="color: #D1A36C; text-align: center;">🎯 Your Retirement Plan</h2>', unsafe_allow_html=True)
 
     # Section A: Goal Summary
     display_goal_summary(result, inputs)
 
     # Section B: Authoritative Numbers
-    display_authoritative_numbers(result)
+    display_authoritative_numbers(view)
 
     # Section C: Explanation
-    display_explanation(result, inputs)
+    display_explanation(result, view)
 
     # Section D: Assumptions
     display_assumptions(result)
@@ -969,35 +928,122 @@ def display_result_card(result: RetirementResult, inputs: RetirementInputs):
 
     # What-If Scenarios
     st.markdown("---")
-    display_whatif_scenarios(inputs, result)
+    display_whatif_scenarios(inputs, result, view)
 
     # Download Excel button
-    st.markdown("---")
-    st.markdown('<h3 style="color: #D1A36C;">📥 Download Your Plan</h3>', unsafe_allow_html=True)
+    st.markdown('---\n<h3 style="color: #D1A36C;">📥 Download Your Plan</h3>', unsafe_allow_html=True)
 
-    excel_data = generate_excel_plan(result, inputs)
-    if excel_data:
+    if HAS_OPENPYXL:
+        # Workbook is built on click, not on every rerun
         st.download_button(
             label="📊 Download Excel Plan (with What-If Scenarios)",
-            data=excel_data,
+            data=partial(build_excel_bytes, astuple(inputs)),
             file_name="retirement_plan.xlsx",
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            on_click="ignore",
             use_container_width=True
         )
         st.caption("Editable spreadsheet with inputs, calculations, and what-if scenarios.")
     else:
-        st.warning("Excel export requires pandas and openpyxl. Install with: pip install pandas openpyxl")
+        st.warning("Excel export requires openpyxl. Install with: pip install openpyxl")
+
+
+def render_followup_chat(followup_prompt: str):
+    """
+    Follow-up chat panel
+    The chat input is created in main() so Streamlit keeps it pinned to the bottom
+    of the page; a submitted question arrives here as followup_prompt
+    """
+    st.markdown("---")
+    st.markdown('<h3 style="color: #D1A36C;">💬 Ask Follow-up Questions</h3>', unsafe_allow_html=True)
+    st.markdown("""
+    <div class="info-box">
+        <strong>You can ask about:</strong><br>
+        • What-if scenarios (e.g., "What if I retire at 58?")<br>
+        • Explanations of any calculation<br>
+        • How to achieve your goals<br>
+        • Impact of changing assumptions
+    </div>
+    """, unsafe_allow_html=True)
+
+    # Display follow-up conversation
+    for msg in st.session_state.followup_messages:
+        with st.chat_message(msg["role"]):
+            st.markdown(msg["content"])
+
+    if followup_prompt:
+        with st.chat_message("user"):
+            st.markdown(followup_prompt)
+
+        # Stream follow-up response
+        with st.chat_message("assistant"):
+            response = st.write_stream(chat_followup_stream(
+                followup_prompt,
+                st.session_state.result,
+                st.session_state.inputs
+            ))
+
+        # Record the exchange once answered; history excludes the in-flight question
+        # (both bubbles are already on screen, so no rerun is needed)
+        st.session_state.followup_messages += [
+            {"role": "user", "content": followup_prompt},
+            {"role": "assistant", "content": response}
+        ]
+
+
+def add_chat_message(message: dict):
+    """
+    Append a message to the rendered chat history
+    The role/content pair also goes onto gpt_messages, which is sent to GPT as-is
+    """
+    st.session_state.messages.append(message)
+    st.session_state.gpt_messages.append({"role": message["role"], "content": message["content"]})
 
 
 def reset_chat():
     """Reset the chat and start fresh"""
     st.session_state.messages = []
+    st.session_state.gpt_messages = []
     st.session_state.calculation_done = False
     st.session_state.result = None
     st.session_state.inputs = None
     st.session_state.collected_data = None
-    st.session_state.whatif_mode = False
     st.session_state.followup_messages = []
+    st.session_state.followup_summary = ""
+    st.session_state.followup_summarized = 0
+
+
+# Static sidebar info, built once at import and sent as a single markdown element
+_SIDEBAR_MD = """
+---
+
+### 📖 How it works
+1. Chat with the assistant
+2. Answer questions one at a time
+3. Get your personalized plan
+4. Ask follow-up questions
+5. Download PDF/Excel reports
+
+---
+
+### 📊 Data We Collect
+- Current age
+- Desired retirement age
+- Life expectancy
+- Current expenses (monthly/annual)
+- Current investments
+- Risk preference
+- Dependents info
+- Current income
+
+---
+
+### 🔒 Locked Assumptions
+- **Inflation:** 6% p.a.
+- **Conservative return:** 8%
+- **Moderate return:** 12%
+- **Aggressive return:** 15%
+"""
 
 
 def main():
@@ -1030,41 +1076,8 @@ def main():
             reset_chat()
             st.rerun()
 
-        st.markdown("---")
-
-        # Info section
-        st.markdown("### 📖 How it works")
-        st.markdown("""
-        1. Chat with the assistant
-        2. Answer questions one at a time
-        3. Get your personalized plan
-        4. Ask follow-up questions
-        5. Download PDF/Excel reports
-        """)
-
-        st.markdown("---")
-
-        st.markdown("### 📊 Data We Collect")
-        st.markdown("""
-        - Current age
-        - Desired retirement age
-        - Life expectancy
-        - Current expenses (monthly/annual)
-        - Current investments
-        - Risk preference
-        - Dependents info
-        - Current income
-        """)
-
-        st.markdown("---")
-
-        st.markdown("### 🔒 Locked Assumptions")
-        st.markdown("""
-        - **Inflation:** 6% p.a.
-        - **Conservative return:** 8%
-        - **Moderate return:** 12%
-        - **Aggressive return:** 15%
-        """)
+        # Static info sections, sent as one element
+        st.markdown(_SIDEBAR_MD)
 
     # Check for API key from environment
     if not os.getenv("OPENAI_API_KEY"):
@@ -1106,15 +1119,13 @@ def main():
         # Display chat messages
         for message in st.session_state.messages:
             with st.chat_message(message["role"]):
-                # Don't display the JSON part of CALCULATION_READY
-                content = message["content"]
-                if "CALCULATION_READY" in content:
-                    content = content.split("CALCULATION_READY")[0].strip()
-                    if content:
-                        st.markdown(content)
+                # Don't display the JSON part of CALCULATION_READY (split at insert time)
+                if "display_content" in message:
+                    if message["display_content"]:
+                        st.markdown(message["display_content"])
                     st.success("✅ All information collected! Your retirement plan is ready above.")
                 else:
-                    st.markdown(content)
+                    st.markdown(message["content"])
 
     # Start conversation if empty
     if not st.session_state.messages:
@@ -1130,7 +1141,7 @@ I'll guide you through a series of questions to understand your retirement goals
 
 Let's begin! **What is your current age?** (You can also share your date of birth if you prefer.)"""
 
-        st.session_state.messages.append({
+        add_chat_message({
             "role": "assistant",
             "content": initial_message
         })
@@ -1141,17 +1152,23 @@ Let's begin! **What is your current age?** (You can also share your date of birt
         # Initial data collection phase
         if prompt := st.chat_input("Type your answer here..."):
             # Add user message
-            st.session_state.messages.append({"role": "user", "content": prompt})
-
-            # Get GPT response
-            gpt_messages = [
-                {"role": m["role"], "content": m["content"]}
-                for m in st.session_state.messages
-            ]
-            response = chat_with_gpt(gpt_messages)
+            add_chat_message({"role": "user", "content": prompt})
+
+            # Stream GPT response; write_stream returns the full text once done
+            with chat_container:
+                with st.chat_message("user"):
+                    st.markdown(prompt)
+                with st.chat_message("assistant"):
+                    # The CALCULATION_READY marker and JSON are kept out of the live display
+                    reply_parts = []
+                    st.write_stream(stream_until_sentinel(
+                        chat_with_gpt_stream(st.session_state.gpt_messages), reply_parts
+                    ))
+            response = "".join(reply_parts)
 
             # Check if calculation is ready
-            calc_data = extract_calculation_data(response)
+            message = build_assistant_message(response)
+            calc_data = message.get("calc_json")
             if calc_data:
                 st.session_state.collected_data = calc_data
                 result, inputs = perform_calculation(calc_data)
@@ -1160,51 +1177,13 @@ Let's begin! **What is your current age?** (You can also share your date of birt
                 st.session_state.calculation_done = True
 
             # Add assistant response
-            st.session_state.messages.append({"role": "assistant", "content": response})
+            add_chat_message(message)
 
             st.rerun()
     else:
         # Follow-up chat phase - dashboard is ready
-        st.markdown("---")
-        st.markdown('<h3 style="color: #D1A36C;">💬 Ask Follow-up Questions</h3>', unsafe_allow_html=True)
-        st.markdown("""
-        <div class="info-box">
-            <strong>You can ask about:</strong><br>
-            • What-if scenarios (e.g., "What if I retire at 58?")<br>
-            • Explanations of any calculation<br>
-            • How to achieve your goals<br>
-            • Impact of changing assumptions
-        </div>
-        """, unsafe_allow_html=True)
-
-        # Display follow-up conversation
-        for msg in st.session_state.followup_messages:
-            with st.chat_message(msg["role"]):
-                st.markdown(msg["content"])
-
-        # Follow-up chat input
-        if followup_prompt := st.chat_input("Ask a follow-up question..."):
-            # Add user message to followup
-            st.session_state.followup_messages.append({
-                "role": "user",
-                "content": followup_prompt
-            })
-
-            # Get follow-up response
-            with st.spinner("Thinking..."):
-                response = chat_followup(
-                    followup_prompt,
-                    st.session_state.result,
-                    st.session_state.inputs
-                )
-
-            # Add assistant response
-            st.session_state.followup_messages.append({
-                "role": "assistant",
-                "content": response
-            })
-
-            st.rerun()
+        # chat_input stays outside any container/fragment so it is pinned to the bottom
+        render_followup_chat(st.chat_input("Ask a follow-up question..."))
 
 
 if __name__ == "__main__":
@@ -4,12 +4,25 @@ Excel-Wired | Deterministic | FV-based SIP
 Based on the authoritative Excel model logic
 """
 
-from dataclasses import dataclass
-from typing import List
+from dataclasses import dataclass, field, replace
+from typing import Dict, List, Optional, Sequence
+from io import BytesIO
+import importlib.util
 import math
 
+import numpy as np
 
-@dataclass
+
+# Standard retirement ages offered as what-if comparisons
+WHATIF_AGES = (55, 58, 60, 62, 65)
+
+# openpyxl is optional and only needed for the Excel export: probe for it once without
+# importing, and import it on the first export (see _openpyxl_workbook)
+HAS_OPENPYXL = importlib.util.find_spec("openpyxl") is not None
+_Workbook = None
+
+
+@dataclass(slots=True, frozen=True)
 class RetirementInputs:
     """Input data for retirement planning calculations"""
     current_age: int
@@ -23,7 +36,17 @@ class RetirementInputs:
     inflation_rate: float = 0.06  # Locked at 6%
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
+class WhatIfScenario:
+    """Headline figures for the plan with a different retirement age"""
+    retirement_age: int
+    years_to_retirement: int
+    retirement_duration: int
+    corpus_required: float
+    monthly_savings_rounded: float
+
+
+@dataclass(slots=True, frozen=True)
 class RetirementResult:
     """Output of retirement planning calculations"""
     # Timeline
@@ -55,6 +78,9 @@ class RetirementResult:
     # Assumptions list
     assumptions: List[str]
 
+    # Standard what-if ages (WHATIF_AGES after current age), keyed by retirement age
+    whatif_scenarios: Dict[int, WhatIfScenario] = field(default_factory=dict)
+
 
 def get_return_rate(risk_profile: str) -> float:
     """
@@ -73,20 +99,25 @@ def get_return_rate(risk_profile: str) -> float:
     return rates.get(risk_profile.lower(), 0.12)
 
 
-def calculate_future_value(present_value: float, rate: float, years: int) -> float:
+def calculate_future_value(present_value: float, rate: float, years: int,
+                           growth: Optional[float] = None) -> float:
     """
     Calculate future value using compound interest
     FV = PV * (1 + r)^n
+    growth: optional precomputed (1 + r)^n
     """
     if years <= 0:
         return present_value
-    return present_value * ((1 + rate) ** years)
+    if growth is None:
+        growth = (1 + rate) ** years
+    return present_value * growth
 
 
 def calculate_corpus_for_retirement(annual_expense_at_retirement: float,
                                     return_rate: float,
                                     inflation_rate: float,
-                                    retirement_duration: int) -> float:
+                                    retirement_duration: int,
+                                    ratio_pow: Optional[float] = None) -> float:
     """
     Calculate corpus required at retirement to fund expenses for retirement duration.
 
@@ -98,6 +129,8 @@ def calculate_corpus_for_retirement(annual_expense_at_retirement: float,
     - Growth rate = inflation_rate (expenses grow with inflation)
     - Discount rate = return_rate (investment returns during retirement)
     - Duration = retirement_duration years
+
+    ratio_pow: optional precomputed ((1 + g) / (1 + r))^n
     """
     if retirement_duration <= 0:
         return 0
@@ -119,18 +152,23 @@ def calculate_corpus_for_retirement(annual_expense_at_retirement: float,
     if abs(r - g) < 0.0001:  # Effectively equal
         corpus = pmt * n / (1 + r)
     else:
-        corpus = pmt * (1 - ((1 + g) / (1 + r)) ** n) / (r - g)
+        if ratio_pow is None:
+            # ((1 + g) / (1 + r))^n in log space: two libm calls, no float __pow__
+            ratio_pow = math.exp(n * (math.log1p(g) - math.log1p(r)))
+        corpus = pmt * (1 - ratio_pow) / (r - g)
 
     return max(0, corpus)
 
 
-def calculate_monthly_sip(future_value: float, annual_rate: float, years: int) -> float:
+def calculate_monthly_sip(future_value: float, annual_rate: float, years: int,
+                          growth_m1: Optional[float] = None) -> float:
     """
     Calculate monthly SIP (PMT) required to reach future value
     FV-based SIP formula (constant monthly, no step-ups)
 
     PMT = FV * [r / ((1+r)^n - 1)]
     where r = monthly rate, n = number of months
+    growth_m1: optional precomputed (1 + r)^n - 1
     """
     if years <= 0:
         return 0
@@ -144,7 +182,10 @@ def calculate_monthly_sip(future_value: float, annual_rate: float, years: int) -
         return future_value / months
 
     # PMT for future value annuity
-    pmt = future_value * (monthly_rate / (((1 + monthly_rate) ** months) - 1))
+    # (1 + r)^n - 1 via expm1/log1p: no cancellation for small monthly rates
+    if growth_m1 is None:
+        growth_m1 = math.expm1(months * math.log1p(monthly_rate))
+    pmt = future_value * (monthly_rate / growth_m1)
     return pmt
 
 
@@ -157,13 +198,13 @@ def round_to_clean_figure(amount: float, to_nearest: int = 500) -> float:
     if amount <= 0:
         return 0
 
-    if amount > 50000:
-        to_nearest = 1000
-
-    return round(amount / to_nearest) * to_nearest
+    # Branchless step pick: bool promotes to 0/1, so above 50000 the step becomes 1000
+    step = to_nearest + (1000 - to_nearest) * (amount > 50000)
+    return round(amount / step) * step
 
 
-def calculate_retirement_plan(inputs: RetirementInputs) -> RetirementResult:
+def calculate_retirement_plan(inputs: RetirementInputs,
+                              whatif_ages: Sequence[int] = WHATIF_AGES) -> RetirementResult:
     """
     Main calculation function for retirement planning
     Follows the Excel model as authoritative source
@@ -176,6 +217,9 @@ def calculate_retirement_plan(inputs: RetirementInputs) -> RetirementResult:
     R10. Future value of existing investments
     R11. Corpus gap = corpus required − future investments
     R13. Monthly savings using FV-based SIP, rounded to clean figure
+
+    What-if scenarios for whatif_ages are computed once here, in a single
+    vectorized pass, so the UI and Excel export can reuse them
     """
 
     # R3: Years to retirement (time to save)
@@ -187,11 +231,19 @@ def calculate_retirement_plan(inputs: RetirementInputs) -> RetirementResult:
     # R12: Get expected return rate based on risk profile
     expected_return = get_return_rate(inputs.risk_profile)
 
+    # Compounding factors, each evaluated once per plan
+    inflation_growth = (1 + inputs.inflation_rate) ** years_to_retirement
+    return_growth = (1 + expected_return) ** years_to_retirement
+    ratio_pow = math.exp(retirement_duration * (math.log1p(inputs.inflation_rate)
+                                                - math.log1p(expected_return)))
+    sip_growth_m1 = math.expm1(years_to_retirement * 12 * math.log1p(expected_return / 12))
+
     # R8: Living expenses at retirement (inflated)
     future_annual_expenses = calculate_future_value(
         inputs.current_annual_expenses,
         inputs.inflation_rate,
-        years_to_retirement
+        years_to_retirement,
+        growth=inflation_growth
     )
 
     # R9: Corpus required (using same return rate for discounting)
@@ -199,14 +251,16 @@ def calculate_retirement_plan(inputs: RetirementInputs) -> RetirementResult:
         future_annual_expenses,
         expected_return,
         inputs.inflation_rate,
-        retirement_duration
+        retirement_duration,
+        ratio_pow=ratio_pow
     )
 
     # R10: Future value of existing investments at retirement
     future_investment_value = calculate_future_value(
         inputs.current_investments,
         expected_return,
-        years_to_retirement
+        years_to_retirement,
+        growth=return_growth
     )
 
     # R11: Corpus gap
@@ -216,7 +270,8 @@ def calculate_retirement_plan(inputs: RetirementInputs) -> RetirementResult:
     monthly_savings = calculate_monthly_sip(
         corpus_gap,
         expected_return,
-        years_to_retirement
+        years_to_retirement,
+        growth_m1=sip_growth_m1
     )
 
     # Round to clean figure
@@ -237,6 +292,23 @@ def calculate_retirement_plan(inputs: RetirementInputs) -> RetirementResult:
         "Figures are planning-level estimates, not precise forecasts"
     ]
 
+    # What-if scenarios for the standard retirement ages
+    # (skipped entirely for single what-ifs and users already past every age)
+    ages = [age for age in whatif_ages if age > inputs.current_age]
+    whatif_scenarios = {}
+    if ages:
+        batch = calculate_whatif_batch(inputs, ages)
+        whatif_scenarios = {
+            age: WhatIfScenario(age, years, duration, corpus, sip)
+            for age, years, duration, corpus, sip in zip(
+                ages,
+                batch["years_to_retirement"].tolist(),
+                batch["retirement_duration"].tolist(),
+                batch["corpus_required"].tolist(),
+                batch["monthly_savings_rounded"].tolist()
+            )
+        }
+
     return RetirementResult(
         current_age=inputs.current_age,
         retirement_age=inputs.retirement_age,
@@ -256,7 +328,8 @@ def calculate_retirement_plan(inputs: RetirementInputs) -> RetirementResult:
         current_annual_income=inputs.current_annual_income,
         dependents=inputs.dependents,
         income_expense_flag=income_expense_flag,
-        assumptions=assumptions
+        assumptions=assumptions,
+        whatif_scenarios=whatif_scenarios
     )
 
 
@@ -266,18 +339,83 @@ def calculate_whatif_scenario(base_inputs: RetirementInputs,
     Calculate what-if scenario with different retirement age
     Only changes retirement age, all other assumptions remain identical
     """
-    whatif_inputs = RetirementInputs(
-        current_age=base_inputs.current_age,
-        retirement_age=new_retirement_age,
-        life_expectancy=base_inputs.life_expectancy,
-        current_annual_expenses=base_inputs.current_annual_expenses,
-        current_investments=base_inputs.current_investments,
-        current_annual_income=base_inputs.current_annual_income,
-        risk_profile=base_inputs.risk_profile,
-        dependents=base_inputs.dependents,
-        inflation_rate=base_inputs.inflation_rate
+    whatif_inputs = replace(base_inputs, retirement_age=new_retirement_age)
+    return calculate_retirement_plan(whatif_inputs, whatif_ages=())
+
+
+def _plan_kernel(ages: np.ndarray, current_age: int, life_expectancy: int,
+                 current_expenses: float, current_investments: float,
+                 r: float, g: float) -> tuple:
+    """
+    Closed-form plan arithmetic over an array of retirement ages
+    Pure array-in/array-out (no Python objects), mirroring calculate_retirement_plan
+    Returns (future_expenses, corpus, future_investments, gap, sip_exact, sip_rounded)
+    """
+    years = ages - current_age
+    duration = life_expectancy - ages
+
+    # R8, R10: compound growth (no growth for non-positive horizons)
+    grow_years = np.maximum(years, 0)
+    future_expenses = current_expenses * (1 + g) ** grow_years
+    future_investments = current_investments * (1 + r) ** grow_years
+
+    # R9: PV of growing annuity
+    if abs(r - g) < 0.0001:
+        corpus = future_expenses * duration / (1 + r)
+    else:
+        ratio_pow = np.exp(duration * (math.log1p(g) - math.log1p(r)))
+        corpus = future_expenses * (1 - ratio_pow) / (r - g)
+    corpus = np.where(duration > 0, np.maximum(0, corpus), 0.0)
+
+    # R11: Corpus gap
+    gap = np.maximum(0, corpus - future_investments)
+
+    # R13: FV-based SIP
+    monthly_rate = r / 12
+    months = years * 12
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if monthly_rate == 0:
+            sip = gap / months
+        else:
+            sip = gap * (monthly_rate / np.expm1(months * math.log1p(monthly_rate)))
+    sip_exact = np.where((years > 0) & (gap > 0), sip, 0.0)
+
+    # Clean figure: nearest 500, or 1000 above 50000
+    step = np.where(sip_exact > 50000, 1000, 500)
+    sip_rounded = np.where(sip_exact > 0, np.round(sip_exact / step) * step, 0.0)
+
+    return future_expenses, corpus, future_investments, gap, sip_exact, sip_rounded
+
+
+def calculate_whatif_batch(base_inputs: RetirementInputs,
+                           ages: Sequence[int]) -> Dict[str, np.ndarray]:
+    """
+    Vectorized what-if scenarios for several retirement ages in one pass
+    Applies the same formulas as calculate_retirement_plan element-wise over ages,
+    returning arrays keyed by the matching RetirementResult field names
+    """
+    ages = np.asarray(ages, dtype=np.int64)
+    future_expenses, corpus, future_investments, gap, sip_exact, sip_rounded = _plan_kernel(
+        ages,
+        base_inputs.current_age,
+        base_inputs.life_expectancy,
+        base_inputs.current_annual_expenses,
+        base_inputs.current_investments,
+        get_return_rate(base_inputs.risk_profile),
+        base_inputs.inflation_rate
     )
-    return calculate_retirement_plan(whatif_inputs)
+
+    return {
+        "retirement_age": ages,
+        "years_to_retirement": ages - base_inputs.current_age,
+        "retirement_duration": base_inputs.life_expectancy - ages,
+        "future_annual_expenses": future_expenses,
+        "corpus_required": corpus,
+        "future_investment_value": future_investments,
+        "corpus_gap": gap,
+        "monthly_savings_required": sip_exact,
+        "monthly_savings_rounded": sip_rounded
+    }
 
 
 def format_currency(amount: float, currency_symbol: str = "₹") -> str:
@@ -318,131 +456,119 @@ def format_result_summary(result: RetirementResult) -> dict:
     }
 
 
-def generate_excel_plan(result: RetirementResult, inputs: RetirementInputs) -> bytes:
+# Static Excel sheet layout: (label, note/formula) pairs matched to values at write time
+_EXCEL_INPUTS_HEADER = ('Parameter', 'Value', 'Notes')
+_EXCEL_INPUTS_ROWS = (
+    ('Current Age', 'Your current age'),
+    ('Retirement Age', 'Target retirement age (55-65 recommended)'),
+    ('Life Expectancy', 'How long savings should last (default: 85)'),
+    ('Current Annual Expenses (₹)', 'Your current yearly expenses'),
+    ('Current Investments (₹)', 'Total retirement savings you have now'),
+    ('Current Annual Income (₹)', 'Your current yearly income (for reference)'),
+    ('Risk Profile', 'Conservative (8%), Moderate (12%), Aggressive (15%)'),
+    ('Inflation Rate (%)', 'Locked at 6% per annum'),
+    ('Expected Return Rate (%)', 'Based on risk profile selected'),
+)
+_EXCEL_CALC_HEADER = ('Calculation Step', 'Value', 'Formula')
+_EXCEL_CALC_ROWS = (
+    ('Years to Retirement', 'Retirement Age - Current Age'),
+    ('Retirement Duration (Years)', 'Life Expectancy - Retirement Age'),
+    ('Living Expenses at Retirement (₹)', 'Annual Expenses × (1 + Inflation)^Years'),
+    ('Corpus Required (₹)', 'PV of Growing Annuity'),
+    ('Future Value of Current Investments (₹)', 'Current Investments × (1 + Return)^Years'),
+    ('Corpus Gap (₹)', 'Corpus Required - Future Investments'),
+    ('Monthly SIP Required (₹)', 'FV-based SIP formula'),
+    ('Monthly SIP Rounded (₹)', 'Rounded to nearest ₹500/₹1000'),
+)
+_EXCEL_WHATIF_HEADER = ('Retirement Age', 'Years to Retirement', 'Retirement Duration',
+                        'Corpus Required (₹)', 'Monthly SIP Required (₹)')
+_EXCEL_NOTES_HEADER = ('Category', 'Description')
+_EXCEL_DISCLAIMERS = (
+    'This plan is for educational guidance only',
+    'Investments are subject to market risk',
+    'Projections are assumption-based estimates',
+    'Periodic review and adjustment is advised',
+)
+
+
+def _openpyxl_workbook():
+    """openpyxl.Workbook, imported on first use and kept for later exports"""
+    global _Workbook
+    if _Workbook is None:
+        from openpyxl import Workbook
+        _Workbook = Workbook
+    return _Workbook
+
+
+def generate_excel_plan(result: RetirementResult, inputs: RetirementInputs) -> Optional[bytes]:
     """
     Generate downloadable Excel file with editable numbers for what-if scenarios
+    Rows are streamed into a write-only openpyxl workbook (no intermediate DataFrames)
+    Returns None if openpyxl is not installed
     """
-    try:
-        import pandas as pd
-        from io import BytesIO
-
-        # Create Excel writer
-        output = BytesIO()
-
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            # Sheet 1: Inputs (Editable)
-            inputs_data = {
-                'Parameter': [
-                    'Current Age',
-                    'Retirement Age',
-                    'Life Expectancy',
-                    'Current Annual Expenses (₹)',
-                    'Current Investments (₹)',
-                    'Current Annual Income (₹)',
-                    'Risk Profile',
-                    'Inflation Rate (%)',
-                    'Expected Return Rate (%)'
-                ],
-                'Value': [
-                    inputs.current_age,
-                    inputs.retirement_age,
-                    inputs.life_expectancy,
-                    inputs.current_annual_expenses,
-                    inputs.current_investments,
-                    inputs.current_annual_income,
-                    inputs.risk_profile.capitalize(),
-                    inputs.inflation_rate * 100,
-                    result.expected_return_rate * 100
-                ],
-                'Notes': [
-                    'Your current age',
-                    'Target retirement age (55-65 recommended)',
-                    'How long savings should last (default: 85)',
-                    'Your current yearly expenses',
-                    'Total retirement savings you have now',
-                    'Your current yearly income (for reference)',
-                    'Conservative (8%), Moderate (12%), Aggressive (15%)',
-                    'Locked at 6% per annum',
-                    'Based on risk profile selected'
-                ]
-            }
-            df_inputs = pd.DataFrame(inputs_data)
-            df_inputs.to_excel(writer, sheet_name='Inputs', index=False)
-
-            # Sheet 2: Calculations
-            calc_data = {
-                'Calculation Step': [
-                    'Years to Retirement',
-                    'Retirement Duration (Years)',
-                    'Living Expenses at Retirement (₹)',
-                    'Corpus Required (₹)',
-                    'Future Value of Current Investments (₹)',
-                    'Corpus Gap (₹)',
-                    'Monthly SIP Required (₹)',
-                    'Monthly SIP Rounded (₹)'
-                ],
-                'Value': [
-                    result.years_to_retirement,
-                    result.retirement_duration,
-                    round(result.future_annual_expenses, 0),
-                    round(result.corpus_required, 0),
-                    round(result.future_investment_value, 0),
-                    round(result.corpus_gap, 0),
-                    round(result.monthly_savings_required, 0),
-                    result.monthly_savings_rounded
-                ],
-                'Formula': [
-                    'Retirement Age - Current Age',
-                    'Life Expectancy - Retirement Age',
-                    'Annual Expenses × (1 + Inflation)^Years',
-                    'PV of Growing Annuity',
-                    'Current Investments × (1 + Return)^Years',
-                    'Corpus Required - Future Investments',
-                    'FV-based SIP formula',
-                    'Rounded to nearest ₹500/₹1000'
-                ]
-            }
-            df_calc = pd.DataFrame(calc_data)
-            df_calc.to_excel(writer, sheet_name='Calculations', index=False)
-
-            # Sheet 3: What-If Scenarios
-            whatif_ages = [55, 58, 60, 62, 65]
-            whatif_data = []
-
-            for age in whatif_ages:
-                if age > inputs.current_age:
-                    scenario = calculate_whatif_scenario(inputs, age)
-                    whatif_data.append({
-                        'Retirement Age': age,
-                        'Years to Retirement': scenario.years_to_retirement,
-                        'Retirement Duration': scenario.retirement_duration,
-                        'Corpus Required (₹)': round(scenario.corpus_required, 0),
-                        'Monthly SIP Required (₹)': scenario.monthly_savings_rounded
-                    })
-
-            if whatif_data:
-                df_whatif = pd.DataFrame(whatif_data)
-                df_whatif.to_excel(writer, sheet_name='What-If Scenarios', index=False)
-
-            # Sheet 4: Assumptions & Disclaimers
-            assumptions_data = {
-                'Category': ['Assumption'] * len(result.assumptions) + ['Disclaimer'] * 4,
-                'Description': result.assumptions + [
-                    'This plan is for educational guidance only',
-                    'Investments are subject to market risk',
-                    'Projections are assumption-based estimates',
-                    'Periodic review and adjustment is advised'
-                ]
-            }
-            df_assumptions = pd.DataFrame(assumptions_data)
-            df_assumptions.to_excel(writer, sheet_name='Assumptions & Disclaimers', index=False)
-
-        return output.getvalue()
-
-    except ImportError:
-        # If pandas/openpyxl not available, return None
+    if not HAS_OPENPYXL:
         return None
 
+    workbook = _openpyxl_workbook()(write_only=True)
+
+    # Sheet 1: Inputs (Editable)
+    ws = workbook.create_sheet('Inputs')
+    ws.append(_EXCEL_INPUTS_HEADER)
+    input_values = (
+        inputs.current_age,
+        inputs.retirement_age,
+        inputs.life_expectancy,
+        inputs.current_annual_expenses,
+        inputs.current_investments,
+        inputs.current_annual_income,
+        inputs.risk_profile.capitalize(),
+        inputs.inflation_rate * 100,
+        result.expected_return_rate * 100,
+    )
+    for (label, note), value in zip(_EXCEL_INPUTS_ROWS, input_values):
+        ws.append((label, value, note))
+
+    # Sheet 2: Calculations
+    ws = workbook.create_sheet('Calculations')
+    ws.append(_EXCEL_CALC_HEADER)
+    calc_values = (
+        result.years_to_retirement,
+        result.retirement_duration,
+        round(result.future_annual_expenses, 0),
+        round(result.corpus_required, 0),
+        round(result.future_investment_value, 0),
+        round(result.corpus_gap, 0),
+        round(result.monthly_savings_required, 0),
+        result.monthly_savings_rounded,
+    )
+    for (label, formula), value in zip(_EXCEL_CALC_ROWS, calc_values):
+        ws.append((label, value, formula))
+
+    # Sheet 3: What-If Scenarios (precomputed with the plan)
+    if result.whatif_scenarios:
+        ws = workbook.create_sheet('What-If Scenarios')
+        ws.append(_EXCEL_WHATIF_HEADER)
+        for scenario in result.whatif_scenarios.values():
+            ws.append((
+                scenario.retirement_age,
+                scenario.years_to_retirement,
+                scenario.retirement_duration,
+                round(scenario.corpus_required, 0),
+                scenario.monthly_savings_rounded
+            ))
+
+    # Sheet 4: Assumptions & Disclaimers
+    ws = workbook.create_sheet('Assumptions & Disclaimers')
+    ws.append(_EXCEL_NOTES_HEADER)
+    for assumption in result.assumptions:
+        ws.append(('Assumption', assumption))
+    for disclaimer in _EXCEL_DISCLAIMERS:
+        ws.append(('Disclaimer', disclaimer))
+
+    output = BytesIO()
+    workbook.save(output)
+    return output.getvalue()
+
 
 # Test the calculations
 if __name__ == "__main__":